@@ -7,11 +7,12 @@ Falls back to Claude Agent SDK locally if USE_AGENT_SDK=true is set.
 
 import os
 import sys
+import json
 import asyncio
 import logging
-import traceback
-import platform
+from collections import OrderedDict
 from pathlib import Path
+from secrets import token_urlsafe
 from typing import AsyncGenerator, Optional
 from dotenv import load_dotenv
 
@@ -23,15 +24,43 @@ load_dotenv()
 
 log = logging.getLogger("pdf-agent")
 
-# Import skills loader
-from skills import load_skills_from_directory
+# orjson is several times faster than stdlib json for the nested tool-input
+# dicts serialized in the event loop; fall back to stdlib when not installed.
+try:
+    import orjson
+
+    def _dumps(obj) -> str:
+        return orjson.dumps(obj).decode()
+except ImportError:
+    def _dumps(obj) -> str:
+        return json.dumps(obj)
 
-# Load skills at startup
-_skills = load_skills_from_directory()
+# Skills are loaded once by the skills package at import
+from skills import SKILLS as _skills
 
 # Check which backend to use
 USE_AGENT_SDK = os.environ.get("USE_AGENT_SDK", "").lower() == "true"
 
+# The environment is effectively immutable after load_dotenv(); bind the
+# values once so the TTFT-critical handlers don't re-read os.environ per call.
+ENVIRONMENT = os.environ.get("ENVIRONMENT", "development")
+_API_KEY = os.environ.get("ANTHROPIC_API_KEY")
+_MODEL = os.environ.get("ANTHROPIC_MODEL", "claude-haiku-4-5-20251001")
+
+# Fail fast at import rather than erroring per request in production
+if ENVIRONMENT == "production" and not _API_KEY:
+    raise RuntimeError("ANTHROPIC_API_KEY must be set when ENVIRONMENT=production")
+
+# SSE batching: coalesce per-token deltas into time/size-bounded batches so the
+# downstream SSE writer handles far fewer events (one context switch + socket
+# write per batch instead of per token).
+STREAM_BATCH_MS = int(os.environ.get("AGENT_STREAM_BATCH_MS", "20"))
+STREAM_BATCH_BYTES = int(os.environ.get("AGENT_STREAM_BATCH_BYTES", "512"))
+
+# Poll for client disconnect every N upstream events so abandoned streams stop
+# consuming tokens and CPU instead of running to max_tokens.
+DISCONNECT_CHECK_EVERY = 32
+
 # Import Anthropic SDK (lightweight, always available)
 try:
     import anthropic
@@ -52,7 +81,7 @@ if USE_AGENT_SDK:
         AGENT_SDK_AVAILABLE = True
         log.info("claude-agent-sdk imported successfully (USE_AGENT_SDK=true)")
     except ImportError as e:
-        log.warning(f"claude-agent-sdk not available, falling back to direct API: {e}")
+        log.warning("claude-agent-sdk not available, falling back to direct API: %s", e)
 
 
 # ============================================================================
@@ -70,77 +99,174 @@ When answering questions about a PDF:
 Format your responses in markdown when appropriate.
 """
 
+# Freeze the full system prompt once at import: rebuilding it per request
+# allocates the large string fresh each time, and a byte-stable prefix is what
+# lets Anthropic's server-side prompt cache hit across requests.
+_pdf_skill = _skills.get("pdf_analysis")
+_FULL_PDF_PROMPT = PDF_SYSTEM_PROMPT + ("\n\n" + _pdf_skill if _pdf_skill else "")
+
+# System blocks for the direct API path, with cache_control so the server
+# caches the stable prefix.
+_SYSTEM_BLOCKS = [
+    {"type": "text", "text": _FULL_PDF_PROMPT, "cache_control": {"type": "ephemeral"}}
+]
+
 
 # ============================================================================
-# CONVERSATION HISTORY (simple in-memory store for session continuity)
+# CONVERSATION HISTORY (in-memory LRU store for session continuity)
 # ============================================================================
 
-_conversations: dict[str, list[dict]] = {}
+# Cap both the number of sessions (true LRU eviction) and the size of each
+# session's message list, so long chats can't grow process RSS or the prompt
+# tokens sent upstream without bound.
+_MAX_SESSIONS = 50
+_MAX_SESSION_MESSAGES = 30
+_KEEP_RECENT_MESSAGES = 5
+
+_conversations: OrderedDict[str, list[dict]] = OrderedDict()
+
+
+def _prune_messages(messages: list[dict]) -> list[dict]:
+    """Collapse turns older than the most recent few once a session gets long.
+
+    Keeps an odd-length tail (assistant-first) preceded by a single user
+    placeholder so the user/assistant alternation the API expects holds.
+    """
+    if len(messages) <= _MAX_SESSION_MESSAGES:
+        return messages
+    archived = {"role": "user", "content": "[archived prior turns]"}
+    return [archived] + messages[-_KEEP_RECENT_MESSAGES:]
 
 
 # ============================================================================
 # DIRECT ANTHROPIC API STREAMING (lightweight — works everywhere)
 # ============================================================================
 
+# Shared Anthropic client — constructing AsyncAnthropic per request builds a
+# fresh httpx pool and TLS context, so every request paid a full handshake.
+# One module-level client keeps connections warm across requests.
+_anthropic_client: Optional["anthropic.AsyncAnthropic"] = None
+_anthropic_client_lock: Optional[asyncio.Lock] = None
+
+
+async def _get_anthropic_client(api_key: str) -> "anthropic.AsyncAnthropic":
+    """Lazily build the shared AsyncAnthropic client (once per process)."""
+    global _anthropic_client, _anthropic_client_lock
+    if _anthropic_client is not None:
+        return _anthropic_client
+
+    if _anthropic_client_lock is None:
+        _anthropic_client_lock = asyncio.Lock()
+
+    async with _anthropic_client_lock:
+        if _anthropic_client is None:
+            import httpx
+            limits = httpx.Limits(max_keepalive_connections=50, keepalive_expiry=60)
+            try:
+                http_client = httpx.AsyncClient(http2=True, limits=limits)
+            except ImportError:
+                # h2 not installed — HTTP/1.1 keep-alive still pools connections
+                http_client = httpx.AsyncClient(limits=limits)
+            _anthropic_client = anthropic.AsyncAnthropic(
+                api_key=api_key, http_client=http_client
+            )
+    return _anthropic_client
+
+
+async def aclose_anthropic_client():
+    """Close the shared client's connection pool. Called on app shutdown."""
+    global _anthropic_client
+    if _anthropic_client is not None:
+        await _anthropic_client.close()
+        _anthropic_client = None
+
+
 async def _stream_anthropic_direct(
     message: str,
-    session_id: Optional[str] = None
+    session_id: Optional[str] = None,
+    request=None
 ) -> AsyncGenerator[dict, None]:
     """Stream responses using the Anthropic Python SDK directly."""
-    api_key = os.environ.get("ANTHROPIC_API_KEY")
-    if not api_key:
+    if not _API_KEY:
         yield {"type": "error", "error": "ANTHROPIC_API_KEY not configured"}
         return
 
-    model = os.environ.get("ANTHROPIC_MODEL", "claude-haiku-4-5-20251001")
-    pdf_skill = _skills.get("pdf_analysis")
-    system_prompt = PDF_SYSTEM_PROMPT + ("\n\n" + pdf_skill if pdf_skill else "")
+    # Settle the session ID up front — token_urlsafe is cheaper than uuid4
+    # (one os.urandom + base64) and equally unguessable — and announce it
+    # immediately so the client can wire up follow-up turns before the first
+    # token arrives instead of waiting for the complete event
+    if not session_id:
+        session_id = token_urlsafe(16)
+    yield {"type": "session", "session_id": session_id}
 
     # Build message history for session continuity
-    if session_id and session_id in _conversations:
+    if session_id in _conversations:
+        _conversations.move_to_end(session_id)
         messages = _conversations[session_id].copy()
         messages.append({"role": "user", "content": message})
     else:
         messages = [{"role": "user", "content": message}]
 
-    log.info(f"[pdf-agent] Direct API call — model={model}, messages={len(messages)}")
+    log.info("[pdf-agent] Direct API call — model=%s, messages=%d", _MODEL, len(messages))
 
     try:
-        client = anthropic.AsyncAnthropic(api_key=api_key)
-        full_content = ""
+        client = await _get_anthropic_client(_API_KEY)
+        # Accumulate deltas in a list and join once — += on a str copies the
+        # whole prefix per token, O(n^2) over a long response
+        content_parts: list[str] = []
+
+        loop = asyncio.get_running_loop()
+        flush_interval = STREAM_BATCH_MS / 1000.0
+        batch: list[str] = []
+        batch_size = 0
+        last_flush = loop.time()
+        delta_count = 0
 
         async with client.messages.stream(
-            model=model,
+            model=_MODEL,
             max_tokens=8192,
-            system=system_prompt,
+            system=_SYSTEM_BLOCKS,
             messages=messages,
         ) as stream:
             async for event in stream:
                 if event.type == "content_block_delta":
+                    delta_count += 1
+                    if delta_count % DISCONNECT_CHECK_EVERY == 0:
+                        if request is not None and await request.is_disconnected():
+                            log.info("[pdf-agent] Client disconnected — aborting stream, session=%s", session_id)
+                            return
                     if hasattr(event.delta, "text"):
                         text = event.delta.text
-                        full_content += text
-                        yield {"type": "text", "content": text}
-
-        # Generate a session ID if we don't have one
-        if not session_id:
-            import uuid
-            session_id = str(uuid.uuid4())
-
-        # Store conversation history
+                        content_parts.append(text)
+                        batch.append(text)
+                        batch_size += len(text)
+                        now = loop.time()
+                        if batch_size >= STREAM_BATCH_BYTES or now - last_flush >= flush_interval:
+                            yield {"type": "text", "content": "".join(batch)}
+                            batch.clear()
+                            batch_size = 0
+                            last_flush = now
+
+        # Flush any remaining buffered text before completing
+        if batch:
+            yield {"type": "text", "content": "".join(batch)}
+
+        full_content = "".join(content_parts)
+
+        # Store conversation history (most-recently-used at the end)
         messages.append({"role": "assistant", "content": full_content})
-        _conversations[session_id] = messages
+        _conversations[session_id] = _prune_messages(messages)
+        _conversations.move_to_end(session_id)
 
-        # Prune old conversations (keep max 50)
-        if len(_conversations) > 50:
-            oldest = list(_conversations.keys())[0]
-            del _conversations[oldest]
+        # Evict the least-recently-used session — O(1)
+        if len(_conversations) > _MAX_SESSIONS:
+            _conversations.popitem(last=False)
 
-        log.info(f"[pdf-agent] Direct API complete — length={len(full_content)}, session={session_id}")
+        log.info("[pdf-agent] Direct API complete — length=%d, session=%s", len(full_content), session_id)
         yield {"type": "complete", "content": full_content, "session_id": session_id}
 
     except Exception as e:
-        log.error(f"[pdf-agent] Direct API error: {type(e).__name__}: {e}")
+        log.error("[pdf-agent] Direct API error: %s: %s", type(e).__name__, e)
         yield {"type": "error", "error": str(e)}
 
 
@@ -150,84 +276,131 @@ async def _stream_anthropic_direct(
 
 async def _stream_agent_sdk(
     message: str,
-    session_id: Optional[str] = None
+    session_id: Optional[str] = None,
+    request=None
 ) -> AsyncGenerator[dict, None]:
     """Stream responses using the Claude Agent SDK (spawns subprocess)."""
-    api_key = os.environ.get("ANTHROPIC_API_KEY")
-    if not api_key:
+    if not _API_KEY:
         yield {"type": "error", "error": "ANTHROPIC_API_KEY not configured"}
         return
 
-    model = os.environ.get("ANTHROPIC_MODEL", "claude-haiku-4-5-20251001")
-    pdf_skill = _skills.get("pdf_analysis")
-    full_pdf_prompt = PDF_SYSTEM_PROMPT + ("\n\n" + pdf_skill if pdf_skill else "")
-
-    log.info(f"[pdf-agent] Agent SDK query — model={model}, session_id={session_id}")
+    log.info("[pdf-agent] Agent SDK query — model=%s, session_id=%s", _MODEL, session_id)
 
     try:
         options = ClaudeAgentOptions(
-            model=model,
+            model=_MODEL,
             allowed_tools=["WebSearch", "WebFetch", "Read", "Glob", "Grep"],
-            system_prompt=full_pdf_prompt,
+            system_prompt=_FULL_PDF_PROMPT,
             permission_mode="bypassPermissions",
         )
 
         if session_id:
             options.resume = session_id
 
-        full_content = ""
+        # Same list-accumulate/join-once pattern as the direct API path
+        content_parts: list[str] = []
+        result_override: Optional[str] = None
         new_session_id = None
 
+        loop = asyncio.get_running_loop()
+        flush_interval = STREAM_BATCH_MS / 1000.0
+        batch: list[str] = []
+        batch_size = 0
+        last_flush = loop.time()
+
+        def _drain_batch() -> Optional[dict]:
+            """Flush buffered text so non-text events stay ordered."""
+            nonlocal batch_size
+            if not batch:
+                return None
+            event = {"type": "text", "content": "".join(batch)}
+            batch.clear()
+            batch_size = 0
+            return event
+
+        event_count = 0
         async for message_event in query(prompt=message, options=options):
-            event_type = getattr(message_event, 'type', None)
-            subtype = getattr(message_event, 'subtype', None)
-
-            if event_type == "system" and subtype == "init":
-                new_session_id = getattr(message_event, 'session_id', None)
-                continue
-
-            if event_type == "assistant" and subtype == "thinking":
-                thinking_content = getattr(message_event, 'content', '')
-                if thinking_content:
-                    yield {"type": "thinking", "content": thinking_content}
-
-            elif event_type == "assistant" and subtype == "text":
-                content = getattr(message_event, 'content', '')
-                if content:
-                    full_content += content
-                    yield {"type": "text", "content": content}
-
-            elif event_type == "tool_use":
-                tool_name = getattr(message_event, 'tool_name', getattr(message_event, 'name', 'Unknown'))
-                tool_input = getattr(message_event, 'tool_input', getattr(message_event, 'input', ''))
-                if isinstance(tool_input, dict):
-                    import json
-                    tool_input = json.dumps(tool_input)
-                yield {
-                    "type": "tool_call",
-                    "tool_name": tool_name,
-                    "tool_input": str(tool_input) if tool_input else ""
-                }
-
-            elif event_type == "tool_result":
-                pass
-
-            elif hasattr(message_event, 'result'):
-                result = message_event.result
-                if result and result != full_content:
-                    full_content = result
-
-            elif event_type == "error":
-                error_msg = getattr(message_event, 'error', getattr(message_event, 'message', 'Unknown error'))
-                yield {"type": "error", "error": str(error_msg)}
-                return
-
-        log.info(f"[pdf-agent] Agent SDK complete — length={len(full_content)}, session={new_session_id}")
+            event_count += 1
+            if event_count % DISCONNECT_CHECK_EVERY == 0:
+                if request is not None and await request.is_disconnected():
+                    log.info("[pdf-agent] Client disconnected — aborting Agent SDK query, session=%s", session_id)
+                    return
+
+            # Structural match on (type, subtype) — each attribute is read
+            # exactly once per event instead of the previous getattr chain.
+            match (getattr(message_event, 'type', None),
+                   getattr(message_event, 'subtype', None)):
+
+                case ("system", "init"):
+                    new_session_id = getattr(message_event, 'session_id', None)
+
+                case ("assistant", "thinking"):
+                    pending = _drain_batch()
+                    if pending:
+                        yield pending
+                    thinking_content = getattr(message_event, 'content', '')
+                    if thinking_content:
+                        yield {"type": "thinking", "content": thinking_content}
+
+                case ("assistant", "text"):
+                    content = getattr(message_event, 'content', '')
+                    if content:
+                        content_parts.append(content)
+                        batch.append(content)
+                        batch_size += len(content)
+                        now = loop.time()
+                        if batch_size >= STREAM_BATCH_BYTES or now - last_flush >= flush_interval:
+                            yield {"type": "text", "content": "".join(batch)}
+                            batch.clear()
+                            batch_size = 0
+                            last_flush = now
+
+                case ("tool_use", _):
+                    pending = _drain_batch()
+                    if pending:
+                        yield pending
+                    tool_name = getattr(message_event, 'tool_name', getattr(message_event, 'name', 'Unknown'))
+                    tool_input = getattr(message_event, 'tool_input', getattr(message_event, 'input', ''))
+                    if isinstance(tool_input, dict):
+                        tool_input = _dumps(tool_input)
+                    yield {
+                        "type": "tool_call",
+                        "tool_name": tool_name,
+                        "tool_input": str(tool_input) if tool_input else ""
+                    }
+
+                case ("tool_result", _):
+                    pass
+
+                case ("error", _):
+                    pending = _drain_batch()
+                    if pending:
+                        yield pending
+                    error_msg = getattr(message_event, 'error', getattr(message_event, 'message', 'Unknown error'))
+                    yield {"type": "error", "error": str(error_msg)}
+                    return
+
+                case _ if hasattr(message_event, 'result'):
+                    result = message_event.result
+                    if result:
+                        result_override = result
+
+        # Flush any remaining buffered text before completing
+        pending = _drain_batch()
+        if pending:
+            yield pending
+
+        full_content = "".join(content_parts)
+        if result_override and result_override != full_content:
+            full_content = result_override
+
+        log.info("[pdf-agent] Agent SDK complete — length=%d, session=%s", len(full_content), new_session_id)
         yield {"type": "complete", "content": full_content, "session_id": new_session_id}
 
     except Exception as e:
-        log.error(f"[pdf-agent] Agent SDK error: {type(e).__name__}: {e}")
-        log.error(f"[pdf-agent] Traceback:\n{traceback.format_exc()}")
+        import traceback
+        log.error("[pdf-agent] Agent SDK error: %s: %s", type(e).__name__, e)
+        log.error("[pdf-agent] Traceback:\n%s", traceback.format_exc())
         yield {"type": "error", "error": f"{type(e).__name__}: {e}"}
 
 
@@ -237,19 +410,21 @@ async def _stream_agent_sdk(
 
 async def stream_pdf_response(
     message: str,
-    session_id: Optional[str] = None
+    session_id: Optional[str] = None,
+    request=None
 ) -> AsyncGenerator[dict, None]:
     """
     Stream PDF analysis responses.
     Uses Agent SDK if USE_AGENT_SDK=true and available, otherwise direct Anthropic API.
+    Pass the FastAPI Request so dead client streams are detected and aborted.
     """
     if USE_AGENT_SDK and AGENT_SDK_AVAILABLE:
         log.info("[pdf-agent] Using Claude Agent SDK backend")
-        async for event in _stream_agent_sdk(message, session_id):
+        async for event in _stream_agent_sdk(message, session_id, request):
             yield event
     elif ANTHROPIC_SDK_AVAILABLE:
         log.info("[pdf-agent] Using direct Anthropic API backend")
-        async for event in _stream_anthropic_direct(message, session_id):
+        async for event in _stream_anthropic_direct(message, session_id, request):
             yield event
     else:
         yield {"type": "error", "error": "No AI backend available. Install anthropic: pip install anthropic"}
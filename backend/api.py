@@ -12,29 +12,45 @@ if sys.platform == "win32":
     asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
 
 import time
-from collections import defaultdict
+from collections import defaultdict, deque
 
 from fastapi import FastAPI, UploadFile, File, Form, Request
-from fastapi.responses import StreamingResponse, JSONResponse
-from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, JSONResponse, Response
 from typing import Optional
 
 # Rate limiting: 10 requests per hour per IP
 RATE_LIMIT = 10
 RATE_WINDOW = 3600  # seconds
-_request_log: dict[str, list[float]] = defaultdict(list)
+_SWEEP_INTERVAL = 300  # seconds between sweeps of empty per-IP deques
+_request_log: dict[str, deque[float]] = defaultdict(deque)
 
 
 def _check_rate_limit(ip: str) -> tuple[bool, int]:
     """Returns (allowed, remaining) for the given IP."""
-    now = time.time()
-    timestamps = _request_log[ip]
-    # Prune old entries
-    _request_log[ip] = [t for t in timestamps if now - t < RATE_WINDOW]
-    if len(_request_log[ip]) >= RATE_LIMIT:
+    # Monotonic clock so wall-clock jumps can't reset or extend the window
+    now = time.monotonic()
+    dq = _request_log[ip]
+    # Drop out-of-window entries from the left — amortised O(1) per request
+    cutoff = now - RATE_WINDOW
+    while dq and dq[0] < cutoff:
+        dq.popleft()
+    if len(dq) >= RATE_LIMIT:
         return False, 0
-    _request_log[ip].append(now)
-    return True, RATE_LIMIT - len(_request_log[ip])
+    dq.append(now)
+    return True, RATE_LIMIT - len(dq)
+
+
+async def _sweep_rate_limit_log():
+    """Periodically drop empty deques so one-off scanner IPs don't accumulate."""
+    while True:
+        await asyncio.sleep(_SWEEP_INTERVAL)
+        cutoff = time.monotonic() - RATE_WINDOW
+        for ip in list(_request_log):
+            dq = _request_log[ip]
+            while dq and dq[0] < cutoff:
+                dq.popleft()
+            if not dq:
+                del _request_log[ip]
 
 # Import business logic from main.py
 import main
@@ -47,20 +63,87 @@ log = get_logger()
 # FastAPI app
 app = FastAPI(title="PDF Analysis API")
 
-# CORS middleware - Allow all origins for development
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=False,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# CORS - Allow all origins for development. The app never uses credentials,
+# so a pure-ASGI wrapper with prebuilt headers replaces Starlette's
+# CORSMiddleware. (@app.middleware would register BaseHTTPMiddleware, which
+# spawns a task group per request and pipes streaming bodies through memory
+# streams — more per-SSE-chunk overhead, not less.)
+_CORS_HEADERS = [
+    (b"access-control-allow-origin", b"*"),
+    (b"access-control-allow-methods", b"*"),
+    (b"access-control-allow-headers", b"*"),
+]
+
+
+class _CORSMiddleware:
+    """Append the allow-all CORS headers at the ASGI layer.
+
+    Wraps send() directly: headers go on http.response.start, preflight gets
+    a static 204, and body chunks pass through untouched.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        if scope["method"] == "OPTIONS":
+            await send({"type": "http.response.start", "status": 204, "headers": _CORS_HEADERS})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        async def send_with_cors(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + _CORS_HEADERS
+            await send(message)
+
+        await self.app(scope, receive, send_with_cors)
+
+
+app.add_middleware(_CORSMiddleware)
+
+
+# The event loop keeps only weak refs to tasks; without this module-level
+# handle the sweeper could be garbage-collected and silently stop pruning
+_sweeper_task: Optional[asyncio.Task] = None
+
+
+@app.on_event("startup")
+async def _start_rate_limit_sweeper():
+    global _sweeper_task
+    _sweeper_task = asyncio.create_task(_sweep_rate_limit_log())
+
+
+@app.on_event("shutdown")
+async def _close_anthropic_client():
+    import agent
+    await agent.aclose_anthropic_client()
+
+
+# Health checkers can hit /ping at high frequency; serve a pre-serialized
+# payload so each probe skips pydantic validation and JSON encoding.
+_PING_BODY = b'{"status":"ok","service":"pdf-analysis-api"}'
 
 
 @app.get("/ping")
 async def ping():
     """Simple health check endpoint."""
-    return {"status": "ok", "service": "pdf-analysis-api"}
+    return Response(content=_PING_BODY, media_type="application/json")
+
+
+# Read uploads in 1 MB chunks rather than one full-body read() so large PDFs
+# don't monopolise the event loop, and assemble the bytes with a single join.
+_UPLOAD_CHUNK = 1024 * 1024
+
+
+async def _read_upload(file: UploadFile) -> bytes:
+    chunks: list[bytes] = []
+    while chunk := await file.read(_UPLOAD_CHUNK):
+        chunks.append(chunk)
+    return b"".join(chunks)
 
 
 @app.post("/pdf/ask")
@@ -70,6 +153,7 @@ async def pdf_ask(
     question: str = Form(...),
     session_id: Optional[str] = Form(None),
     sdk_session_id: Optional[str] = Form(None),
+    pdf_text_cache_key: Optional[str] = Form(None),
 ):
     """SSE endpoint for asking questions about a PDF."""
     client_ip = request.client.host if request.client else "unknown"
@@ -84,7 +168,7 @@ async def pdf_ask(
     file_content = None
     filename = None
     if file and file.filename:
-        file_content = await file.read()
+        file_content = await _read_upload(file)
         filename = file.filename
 
     return StreamingResponse(
@@ -94,6 +178,7 @@ async def pdf_ask(
             question=question,
             session_id=session_id,
             sdk_session_id=sdk_session_id,
+            pdf_text_cache_key=pdf_text_cache_key,
             request=request,
         ),
         media_type="text/event-stream"
@@ -101,10 +186,28 @@ async def pdf_ask(
 
 
 if __name__ == "__main__":
+    import os
     import uvicorn
     import logging
 
     logging.getLogger("uvicorn.access").setLevel(logging.WARNING)
     logging.getLogger("httpx").setLevel(logging.WARNING)
 
-    uvicorn.run(app, host="0.0.0.0", port=8020, log_level="info", loop="asyncio")
+    if sys.platform == "win32":
+        # uvloop/httptools are Unix-only — keep the pure-Python stack here
+        uvicorn.run(app, host="0.0.0.0", port=8020, log_level="info", loop="asyncio")
+    else:
+        # libuv event loop + C http parser. Workers default to 1 because
+        # conversation history, the per-IP rate limit, and the reader cache
+        # are all process-local — a second worker silently drops follow-up
+        # turns onto the wrong process. Set WEB_CONCURRENCY>1 only once that
+        # state moves to the Redis layer.
+        uvicorn.run(
+            "api:app",
+            host="0.0.0.0",
+            port=8020,
+            log_level="info",
+            loop="uvloop",
+            http="httptools",
+            workers=int(os.environ.get("WEB_CONCURRENCY", "1")),
+        )
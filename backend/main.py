@@ -5,12 +5,21 @@ This module contains the business logic for PDF text extraction and question han
 Uses Gemini Flash for OCR with PyPDF2 fallback.
 """
 
+import io
 import os
+import re
 import json
+import base64
+import asyncio
+import hashlib
 import logging
+import threading
+from collections import OrderedDict
 from dotenv import load_dotenv
 from typing import Optional
 
+from services import cache, retrieval
+
 load_dotenv()
 
 # Configure logging
@@ -18,11 +27,297 @@ LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
 logging.basicConfig(level=getattr(logging, LOG_LEVEL, logging.INFO))
 console_logger = logging.getLogger("pdf-backend")
 
+# SSE framing: encode frames to bytes once here so Starlette's
+# StreamingResponse doesn't re-encode str chunks on every event. Prefers
+# msgspec (encodes into a single preallocated buffer, fastest on the
+# per-token hot path), then orjson, then stdlib json.
+try:
+    import msgspec.json
+
+    _msgspec_encoder = msgspec.json.Encoder()
+
+    def _sse(payload: dict) -> bytes:
+        return b"data: " + _msgspec_encoder.encode(payload) + b"\n\n"
+except ImportError:
+    try:
+        import orjson
+
+        def _sse(payload: dict) -> bytes:
+            return b"data: " + orjson.dumps(payload) + b"\n\n"
+    except ImportError:
+        def _sse(payload: dict) -> bytes:
+            return b"data: " + json.dumps(payload).encode("utf-8") + b"\n\n"
+
+_SSE_DONE = b"data: [DONE]\n\n"
+
+# Static frames encoded once at import — identical on every request
+_STATUS_PROCESSING = _sse({'type': 'status', 'message': 'Processing PDF...'})
+_STATUS_OCR = _sse({'type': 'status', 'message': 'Running OCR with Gemini Flash...'})
+_STATUS_ANALYZING = _sse({'type': 'status', 'message': 'Analyzing document...'})
+_ERROR_NO_API_KEY = _sse({'type': 'error', 'error': 'ANTHROPIC_API_KEY not configured'})
+
 # Anthropic configuration
 ANTHROPIC_API_KEY = os.environ.get("ANTHROPIC_API_KEY")
 
 # Gemini configuration (for PDF OCR)
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
+OCR_MODEL = "gemini-2.5-flash"
+
+# google-genai is optional — deployments without it fall back to local parsing
+try:
+    from google import genai
+except ImportError:
+    genai = None
+
+# One Gemini client per process: construction allocates httpx pools and TLS
+# contexts, and the client is thread-safe, so reuse it across requests
+_gemini_client = None
+_gemini_client_lock = threading.Lock()
+
+
+def _get_gemini_client():
+    global _gemini_client
+    if _gemini_client is None:
+        with _gemini_client_lock:
+            if _gemini_client is None:
+                _gemini_client = genai.Client(api_key=GEMINI_API_KEY)
+    return _gemini_client
+
+# OCR results are content-addressed (sha256 of the PDF bytes + backend name),
+# so re-uploads and retries of the same document skip the OCR call entirely
+OCR_CACHE_TTL = 30 * 24 * 3600  # 30 days
+_HASH_IN_THREAD_BYTES = 10 * 1024 * 1024  # hash big files off the event loop
+
+# Extraction results are keyed ocr:{sha256}:{backend}. Continuation turns
+# probe backends best-first, so a local parse cached after a transient Gemini
+# failure never shadows a later OCR result for the same document.
+_TEXT_BACKEND_PREFERENCE = (OCR_MODEL, "pymupdf", "pypdfium2", "pypdf2")
+
+# Upload cap — bounds worst-case parse/OCR time on pathological files
+MAX_PDF_BYTES = int(os.environ.get("MAX_PDF_BYTES", str(50 * 1024 * 1024)))
+
+# Greeting/meta turns that don't need document context — extraction is skipped
+_SKIP_EXTRACTION_QUESTIONS = {"hi", "hello", "hey", "thanks", "thank you", "ok"}
+
+# PDF_CONTEXT_MODE=retrieval sends only the chunks relevant to the question
+# instead of the whole document once it exceeds the size threshold
+PDF_CONTEXT_MODE = os.environ.get("PDF_CONTEXT_MODE", "full").lower()
+PDF_RETRIEVAL_MIN_CHARS = int(os.environ.get("PDF_RETRIEVAL_MIN_CHARS", "20000"))
+
+# OCR and layout-preserving extractors pad text with runs of spaces and blank
+# lines that bill as tokens without adding content. Patterns are compiled once
+# at import; re.sub with a precompiled pattern skips the per-call cache lookup.
+_SPACE_RUNS = re.compile(r"[ \t]{2,}")
+_BLANK_RUNS = re.compile(r"\n{3,}")
+
+
+def _squeeze_whitespace(text: str) -> str:
+    """Collapse whitespace noise in extracted text before prompting.
+
+    Also drops consecutive duplicate lines — repeated headers/footers survive
+    per-page extraction verbatim. [Page N] markers sit on their own lines and
+    are never duplicated back-to-back, so they pass through untouched.
+    """
+    text = _SPACE_RUNS.sub(" ", text)
+    text = _BLANK_RUNS.sub("\n\n", text)
+    lines = []
+    prev = None
+    for line in text.split("\n"):
+        stripped = line.strip()
+        if stripped and stripped == prev:
+            continue
+        lines.append(line)
+        prev = stripped
+    return "\n".join(lines)
+
+# Opt-in PyMuPDF backend: MuPDF's C engine is ~10x faster than PyPDF2 and
+# handles complex layouts better, but it's AGPL — deployments enable it
+# explicitly with PDF_BACKEND=pymupdf where the licence is acceptable.
+PDF_BACKEND = os.environ.get("PDF_BACKEND", "").lower()
+
+# Parser backends resolved once at import — in-handler imports made the first
+# request pay the module-load latency mid-SSE-stream. Each is optional so a
+# deployment missing one still boots; the extractors check for None.
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+
+try:
+    from PyPDF2 import PdfReader
+except ImportError:
+    PdfReader = None
+
+try:
+    import fitz  # PyMuPDF — only used when PDF_BACKEND=pymupdf
+except ImportError:
+    fitz = None
+
+
+async def _file_hash(file_content: bytes) -> str:
+    if len(file_content) > _HASH_IN_THREAD_BYTES:
+        return await asyncio.to_thread(
+            lambda: hashlib.sha256(file_content).hexdigest()
+        )
+    return hashlib.sha256(file_content).hexdigest()
+
+
+def _extract_pdf_text(file_content: bytes) -> str:
+    """Extract per-page text, preferring pypdfium2 over PyPDF2.
+
+    pypdfium2 binds PDFium's C++ engine and is 5-10x faster than PyPDF2's
+    pure-Python parsing with better text quality; PyPDF2 remains the fallback
+    when it isn't installed. Output keeps the same "[Page N]" framing either
+    way so downstream highlighting is unchanged.
+
+    CPU-bound synchronous parsing — always run via asyncio.to_thread so it
+    can't stall the event loop (and every other SSE stream) while it works.
+    """
+    pages = []
+
+    if PDF_BACKEND == "pymupdf" and fitz is not None:
+        doc = fitz.open(stream=file_content, filetype="pdf")
+        try:
+            # "text" mode preserves paragraph boundaries
+            pages = [f"[Page {i+1}]\n{p.get_text('text')}" for i, p in enumerate(doc)]
+        finally:
+            doc.close()
+        return "\n\n".join(pages)
+
+    if pdfium is not None:
+        pdf = pdfium.PdfDocument(file_content)
+        try:
+            for i, page in enumerate(pdf):
+                textpage = page.get_textpage()
+                page_text = textpage.get_text_range()
+                if page_text:
+                    pages.append(f"[Page {i+1}]\n{page_text}")
+                textpage.close()
+                page.close()
+        finally:
+            pdf.close()
+        return "\n\n".join(pages)
+
+    if PdfReader is None:
+        raise RuntimeError("No PDF parser installed (pypdfium2 or PyPDF2 required)")
+    reader = PdfReader(io.BytesIO(file_content))
+    for i, page in enumerate(reader.pages):
+        page_text = page.extract_text()
+        if page_text:
+            pages.append(f"[Page {i+1}]\n{page_text}")
+    return "\n\n".join(pages)
+
+
+# PyPDF2 extraction is pure Python and GIL-bound, so threads can't parallelise
+# it; shard large documents across worker processes instead. The pool is
+# created lazily so deployments that never hit the fallback don't fork.
+_PARALLEL_MIN_PAGES = 8
+_PARALLEL_SHARDS = 4
+_process_pool: Optional["concurrent.futures.ProcessPoolExecutor"] = None
+
+
+def _get_process_pool():
+    global _process_pool
+    if _process_pool is None:
+        import concurrent.futures
+        import multiprocessing
+        # spawn, not fork: by the time the pool is built lazily the process
+        # has live to_thread workers, and forked children can inherit locks
+        # held mid-operation (e.g. logging) and deadlock
+        _process_pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=min(_PARALLEL_SHARDS, os.cpu_count() or 1),
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _process_pool
+
+
+def _extract_page_range(pdf_bytes: bytes, start: int, end: int) -> list[tuple[int, str]]:
+    """Extract text for pages [start, end). Top-level so it pickles to workers."""
+    reader = PdfReader(io.BytesIO(pdf_bytes))
+    out = []
+    for i in range(start, end):
+        page_text = reader.pages[i].extract_text()
+        if page_text:
+            out.append((i, page_text))
+    return out
+
+
+# Parsed-reader cache: PdfReader re-parses the xref table on every
+# construction, so repeat questions on the same document re-paid the parse.
+# Keyed by content hash with FIFO eviction. PdfReader objects don't pickle,
+# so the process-pool shards still open their own. Each entry carries a lock:
+# readers are not thread-safe (extraction seeks the shared BytesIO and fills
+# lazy object caches), and concurrent questions on one document are exactly
+# the workload this cache serves. Entries retain the source bytes, so the
+# cache can pin up to _READER_CACHE_SIZE x MAX_PDF_BYTES of memory — shrink
+# it before raising the upload cap.
+_READER_CACHE_SIZE = 8
+_reader_cache: OrderedDict[str, tuple[object, threading.Lock]] = OrderedDict()
+
+
+def _get_reader(content_hash: str, file_content: bytes) -> tuple[object, threading.Lock]:
+    entry = _reader_cache.get(content_hash)
+    if entry is None:
+        entry = (PdfReader(io.BytesIO(file_content)), threading.Lock())
+        _reader_cache[content_hash] = entry
+        if len(_reader_cache) > _READER_CACHE_SIZE:
+            _reader_cache.popitem(last=False)
+    return entry
+
+
+def _extract_pages_from_reader(reader, lock: threading.Lock) -> str:
+    pages = []
+    with lock:
+        for i, page in enumerate(reader.pages):
+            page_text = page.extract_text()
+            if page_text:
+                pages.append(f"[Page {i+1}]\n{page_text}")
+    return "\n\n".join(pages)
+
+
+def _local_backend_name() -> str:
+    """Cache-key name of the parser _extract_pdf_text_parallel will pick."""
+    if PDF_BACKEND == "pymupdf" and fitz is not None:
+        return "pymupdf"
+    if pdfium is not None:
+        return "pypdfium2"
+    return "pypdf2"
+
+
+async def _extract_pdf_text_parallel(file_content: bytes, content_hash: str) -> str:
+    """Extract text off the event loop, sharding big PyPDF2 jobs across cores."""
+    # The C-engine backends are fast enough single-threaded
+    if (PDF_BACKEND == "pymupdf" and fitz is not None) or pdfium is not None:
+        return await asyncio.to_thread(_extract_pdf_text, file_content)
+
+    if PdfReader is None:
+        raise RuntimeError("No PDF parser installed (pypdfium2 or PyPDF2 required)")
+
+    # One cached reader serves both the page count and the serial extract,
+    # and survives across re-asks of the same document
+    reader, reader_lock = await asyncio.to_thread(_get_reader, content_hash, file_content)
+
+    def _count_pages() -> int:
+        with reader_lock:
+            return len(reader.pages)
+
+    num_pages = await asyncio.to_thread(_count_pages)
+    if num_pages < _PARALLEL_MIN_PAGES:
+        return await asyncio.to_thread(_extract_pages_from_reader, reader, reader_lock)
+
+    loop = asyncio.get_running_loop()
+    pool = _get_process_pool()
+    shard = (num_pages + _PARALLEL_SHARDS - 1) // _PARALLEL_SHARDS
+    futures = [
+        loop.run_in_executor(
+            pool, _extract_page_range, file_content, s, min(s + shard, num_pages)
+        )
+        for s in range(0, num_pages, shard)
+    ]
+    results = await asyncio.gather(*futures)
+    # gather preserves shard order, and shards are disjoint ascending ranges
+    pages = [f"[Page {i+1}]\n{page_text}" for chunk in results for i, page_text in chunk]
+    return "\n\n".join(pages)
 
 
 def pdf_ask_handler(
@@ -31,6 +326,7 @@ def pdf_ask_handler(
     question: str = "",
     session_id: Optional[str] = None,
     sdk_session_id: Optional[str] = None,
+    pdf_text_cache_key: Optional[str] = None,
     request=None
 ):
     """
@@ -41,67 +337,185 @@ def pdf_ask_handler(
 
     async def event_generator():
         try:
-            yield f"data: {json.dumps({'type': 'status', 'message': 'Processing PDF...'})}\n\n"
+            yield _STATUS_PROCESSING
 
             if not ANTHROPIC_API_KEY:
-                yield f"data: {json.dumps({'type': 'error', 'error': 'ANTHROPIC_API_KEY not configured'})}\n\n"
+                yield _ERROR_NO_API_KEY
                 return
 
+            # Trivial turns ("hi", "thanks") don't need document context —
+            # skip seconds of OCR/extraction and let Claude answer directly
+            q_lower = question.strip().lower()
+            skip_extraction = q_lower in _SKIP_EXTRACTION_QUESTIONS or len(q_lower) < 4
+
             # Extract text from PDF if file provided
             pdf_text = ""
-            if file_content and filename:
+            if skip_extraction:
+                pass
+            elif not file_content and pdf_text_cache_key:
+                # Chat continuation: the client echoes the cache key from a
+                # previous turn so we reuse the extracted text without a
+                # re-upload or re-OCR. Probe backends best-first — the first
+                # turn may have cached under any of them.
+                for backend in _TEXT_BACKEND_PREFERENCE:
+                    cached_text = await cache.get_bytes(f"ocr:{pdf_text_cache_key}:{backend}")
+                    if cached_text:
+                        pdf_text = cached_text.decode("utf-8")
+                        console_logger.info(f"Reusing cached PDF text for key {pdf_text_cache_key[:12]}… ({backend})")
+                        break
+                if not pdf_text:
+                    # The entry expired or was evicted — answering without the
+                    # document would be silently wrong, so ask for a re-upload
+                    yield _sse({'type': 'error', 'error': 'Cached document context is no longer available — please re-upload the PDF'})
+                    return
+            elif file_content and filename:
                 ext = filename.lower().split('.')[-1] if '.' in filename else ''
                 if ext == 'pdf':
+                    # A mislabelled upload shouldn't reach Gemini or the
+                    # parsers — both can burn seconds on non-PDF bytes
+                    if not file_content.startswith(b'%PDF-'):
+                        yield _sse({'type': 'error', 'error': 'Invalid PDF header'})
+                        return
+                    if len(file_content) > MAX_PDF_BYTES:
+                        yield _sse({'type': 'error', 'error': f'PDF too large (max {MAX_PDF_BYTES // (1024 * 1024)} MB)'})
+                        return
+
+                    # Check the content-addressed cache before any OCR work.
+                    # text_cached tracks whether the extracted text is actually
+                    # retrievable, so we never advertise a key that would miss.
+                    file_hash = await _file_hash(file_content)
+                    ocr_cache_key = f"ocr:{file_hash}:{OCR_MODEL}"
+                    text_cached = False
+                    cached_text = await cache.get_bytes(ocr_cache_key)
+                    if cached_text:
+                        pdf_text = cached_text.decode("utf-8")
+                        text_cached = True
+                        console_logger.info(f"OCR cache hit — {len(pdf_text)} chars")
+
                     # Try Gemini Flash OCR first (much better for scanned docs)
-                    if GEMINI_API_KEY:
+                    if not pdf_text and GEMINI_API_KEY and genai is not None:
                         try:
-                            import base64
-                            from google import genai
-
-                            yield f"data: {json.dumps({'type': 'status', 'message': 'Running OCR with Gemini Flash...'})}\n\n"
-
-                            client = genai.Client(api_key=GEMINI_API_KEY)
-                            pdf_b64 = base64.standard_b64encode(file_content).decode("utf-8")
-
-                            response = client.models.generate_content(
-                                model="gemini-2.5-flash",
-                                contents=[
-                                    {
-                                        "parts": [
-                                            {"inline_data": {"mime_type": "application/pdf", "data": pdf_b64}},
-                                            {"text": "Extract ALL text from this PDF. For each page, output exactly:\n\n[Page N]\n<all text on that page>\n\nPreserve the original text exactly as written — names, dates, numbers, abbreviations. Do not summarize or paraphrase. Include every line of text you can read."}
-                                        ]
-                                    }
-                                ],
-                            )
-                            pdf_text = response.text
+                            yield _STATUS_OCR
+
+                            client = _get_gemini_client()
+
+                            # Prefer the Files API: the raw PDF bytes go up
+                            # directly, skipping the 33%-inflated base64 copy
+                            # the inline payload requires. Inline is kept as a
+                            # fallback when the upload fails.
+                            uploaded = None
+                            try:
+                                uploaded = await asyncio.to_thread(
+                                    client.files.upload,
+                                    file=io.BytesIO(file_content),
+                                    config={"mime_type": "application/pdf"},
+                                )
+                                pdf_part = uploaded
+                            except Exception as upload_err:
+                                console_logger.warning(f"Gemini file upload failed, using inline payload: {upload_err}")
+                                # O(filesize) encode — keep it off the event loop
+                                pdf_b64 = await asyncio.to_thread(
+                                    lambda: base64.standard_b64encode(file_content).decode("utf-8")
+                                )
+                                pdf_part = {"inline_data": {"mime_type": "application/pdf", "data": pdf_b64}}
+
+                            try:
+                                # Stream the OCR output: the sync Gemini iterator
+                                # runs in a worker thread feeding a queue, so text
+                                # reaches the client as it arrives instead of after
+                                # the full multi-page response.
+                                loop = asyncio.get_running_loop()
+                                ocr_queue: asyncio.Queue = asyncio.Queue()
+                                contents = [
+                                    pdf_part,
+                                    {"text": "Extract ALL text from this PDF. For each page, output exactly:\n\n[Page N]\n<all text on that page>\n\nPreserve the original text exactly as written — names, dates, numbers, abbreviations. Do not summarize or paraphrase. Include every line of text you can read."},
+                                ]
+
+                                def _run_ocr_stream():
+                                    try:
+                                        stream = client.models.generate_content_stream(
+                                            model=OCR_MODEL,
+                                            contents=contents,
+                                        )
+                                        for chunk in stream:
+                                            piece = chunk.text or ""
+                                            if piece:
+                                                loop.call_soon_threadsafe(ocr_queue.put_nowait, piece)
+                                        loop.call_soon_threadsafe(ocr_queue.put_nowait, None)
+                                    except Exception as exc:
+                                        loop.call_soon_threadsafe(ocr_queue.put_nowait, exc)
+
+                                ocr_task = asyncio.create_task(asyncio.to_thread(_run_ocr_stream))
+                                ocr_parts: list[str] = []
+                                while True:
+                                    item = await ocr_queue.get()
+                                    if item is None:
+                                        break
+                                    if isinstance(item, Exception):
+                                        raise item
+                                    ocr_parts.append(item)
+                                    yield _sse({'type': 'ocr_progress', 'content': item})
+                                await ocr_task
+                            finally:
+                                if uploaded is not None:
+                                    try:
+                                        await asyncio.to_thread(client.files.delete, name=uploaded.name)
+                                    except Exception:
+                                        pass
+
+                            pdf_text = "".join(ocr_parts)
                             console_logger.info(f"Gemini OCR extracted {len(pdf_text)} chars from PDF")
+                            text_cached = await cache.set_bytes(ocr_cache_key, pdf_text.encode("utf-8"), OCR_CACHE_TTL)
                         except Exception as e:
                             console_logger.warning(f"Gemini OCR failed, falling back to PyPDF2: {e}")
                             pdf_text = ""
 
                     # Fallback to PyPDF2 if Gemini not available or failed
                     if not pdf_text:
-                        try:
-                            from PyPDF2 import PdfReader
-                            import io
-                            reader = PdfReader(io.BytesIO(file_content))
-                            pages = []
-                            for i, page in enumerate(reader.pages):
-                                page_text = page.extract_text()
-                                if page_text:
-                                    pages.append(f"[Page {i+1}]\n{page_text}")
-                            pdf_text = "\n\n".join(pages)
-                        except Exception as e:
-                            yield f"data: {json.dumps({'type': 'error', 'error': f'Failed to extract PDF text: {str(e)}'})}\n\n"
-                            return
+                        # Local extractions cache under their own backend name
+                        # so they never masquerade as OCR output on re-uploads
+                        local_cache_key = f"ocr:{file_hash}:{_local_backend_name()}"
+                        cached_text = await cache.get_bytes(local_cache_key)
+                        if cached_text:
+                            pdf_text = cached_text.decode("utf-8")
+                            text_cached = True
+                            console_logger.info(f"Local extraction cache hit — {len(pdf_text)} chars")
+                        else:
+                            try:
+                                pdf_text = await _extract_pdf_text_parallel(file_content, file_hash)
+                            except Exception as e:
+                                yield _sse({'type': 'error', 'error': f'Failed to extract PDF text: {str(e)}'})
+                                return
+                            if pdf_text:
+                                text_cached = await cache.set_bytes(local_cache_key, pdf_text.encode("utf-8"), OCR_CACHE_TTL)
+
+                    if pdf_text and text_cached:
+                        # The client can echo this key on later turns to reuse
+                        # the extracted text without re-uploading the PDF.
+                        # Only advertised when the store succeeded — with
+                        # caching disabled the key would just miss next turn.
+                        yield _sse({'type': 'pdf_cache_key', 'key': file_hash})
                 else:
                     try:
                         pdf_text = file_content.decode('utf-8')
                     except Exception:
-                        yield f"data: {json.dumps({'type': 'error', 'error': 'Unsupported file format'})}\n\n"
+                        yield _sse({'type': 'error', 'error': 'Unsupported file format'})
                         return
 
+            # Trim whitespace padding before anything downstream sees the
+            # text so retrieval scores and the prompt both work on clean input
+            if pdf_text:
+                pdf_text = await asyncio.to_thread(_squeeze_whitespace, pdf_text)
+
+            # Large documents: optionally keep only the chunks relevant to
+            # the question rather than re-sending the full text every turn
+            if (
+                pdf_text
+                and PDF_CONTEXT_MODE == "retrieval"
+                and len(pdf_text) > PDF_RETRIEVAL_MIN_CHARS
+            ):
+                pdf_text = await asyncio.to_thread(retrieval.top_k_chunks, pdf_text, question)
+
             # Build the prompt with PDF context
             if pdf_text:
                 prompt = f"""Here is the content of a PDF document:
@@ -116,42 +530,70 @@ When referencing specific parts of the PDF, wrap the quoted text in <<highlight
             else:
                 prompt = question
 
-            yield f"data: {json.dumps({'type': 'status', 'message': 'Analyzing document...'})}\n\n"
+            yield _STATUS_ANALYZING
 
-            full_content = ""
-            try:
-                from agent import stream_pdf_response
-                async for event in stream_pdf_response(prompt, sdk_session_id):
-                    event_type = event.get("type")
+            from agent import stream_pdf_response
 
-                    if event_type == "thinking":
-                        yield f"data: {json.dumps({'type': 'thinking', 'content': event.get('content', '')})}\n\n"
+            # A bounded queue decouples upstream iteration from SSE framing:
+            # the producer task keeps draining the model stream while a slow
+            # client only backpressures at queue granularity, and framing
+            # errors can't stall the producer mid-event.
+            frame_queue: asyncio.Queue = asyncio.Queue(maxsize=64)
 
-                    elif event_type == "text":
-                        content = event.get("content", "")
-                        full_content += content
-                        yield f"data: {json.dumps({'type': 'text', 'content': content})}\n\n"
+            async def _drain_upstream():
+                # Accumulate relayed text in a list and join at completion —
+                # string += re-copies the whole prefix per chunk
+                full_content_parts: list[str] = []
+                try:
+                    async for event in stream_pdf_response(prompt, sdk_session_id, request):
+                        event_type = event.get("type")
 
-                    elif event_type == "tool_call":
-                        yield f"data: {json.dumps({'type': 'tool_call', 'tool_name': event.get('tool_name'), 'tool_input': event.get('tool_input')})}\n\n"
+                        if event_type == "session":
+                            # Early session announcement — lets the client wire
+                            # up follow-up turns before the first token arrives
+                            await frame_queue.put(_sse({'type': 'session', 'session_id': event.get('session_id')}))
 
-                    elif event_type == "complete":
-                        full_content = event.get("content", full_content)
-                        returned_sdk_session_id = event.get("session_id")
-                        yield f"data: {json.dumps({'type': 'complete', 'content': full_content, 'session_id': returned_sdk_session_id})}\n\n"
+                        elif event_type == "thinking":
+                            await frame_queue.put(_sse({'type': 'thinking', 'content': event.get('content', '')}))
 
-                    elif event_type == "error":
-                        yield f"data: {json.dumps({'type': 'error', 'error': event.get('error')})}\n\n"
+                        elif event_type == "text":
+                            content = event.get("content", "")
+                            full_content_parts.append(content)
+                            await frame_queue.put(_sse({'type': 'text', 'content': content}))
 
-            except Exception as api_error:
-                console_logger.error(f"Claude API error in PDF handler: {str(api_error)}")
-                yield f"data: {json.dumps({'type': 'error', 'error': str(api_error)})}\n\n"
+                        elif event_type == "tool_call":
+                            await frame_queue.put(_sse({'type': 'tool_call', 'tool_name': event.get('tool_name'), 'tool_input': event.get('tool_input')}))
+
+                        elif event_type == "complete":
+                            full_content = event.get("content", "".join(full_content_parts))
+                            returned_sdk_session_id = event.get("session_id")
+                            await frame_queue.put(_sse({'type': 'complete', 'content': full_content, 'session_id': returned_sdk_session_id}))
+
+                        elif event_type == "error":
+                            await frame_queue.put(_sse({'type': 'error', 'error': event.get('error')}))
+
+                except Exception as api_error:
+                    console_logger.error(f"Claude API error in PDF handler: {str(api_error)}")
+                    await frame_queue.put(_sse({'type': 'error', 'error': str(api_error)}))
+                finally:
+                    await frame_queue.put(None)
+
+            producer = asyncio.create_task(_drain_upstream())
+            try:
+                while True:
+                    frame = await frame_queue.get()
+                    if frame is None:
+                        break
+                    yield frame
+            finally:
+                # Covers early generator close (client gone mid-stream)
+                producer.cancel()
 
         except Exception as e:
             console_logger.error(f"Error in PDF ask handler: {str(e)}")
-            yield f"data: {json.dumps({'type': 'error', 'error': str(e)})}\n\n"
+            yield _sse({'type': 'error', 'error': str(e)})
 
         finally:
-            yield "data: [DONE]\n\n"
+            yield _SSE_DONE
 
     return event_generator()
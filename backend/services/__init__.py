@@ -0,0 +1 @@
+"""Service helpers for the PDF backend."""
@@ -0,0 +1,61 @@
+"""
+Async cache service.
+
+Thin wrapper around redis.asyncio used for content-addressed caching of
+expensive upstream results (e.g. Gemini OCR output). Caching is optional:
+when the redis package is not installed or REDIS_URL is unset, every
+operation is a no-op so callers never need to branch on availability.
+"""
+
+import os
+import logging
+from typing import Optional
+
+log = logging.getLogger("pdf-cache")
+
+try:
+    import redis.asyncio as aioredis
+    REDIS_AVAILABLE = True
+except ImportError:
+    aioredis = None
+    REDIS_AVAILABLE = False
+
+REDIS_URL = os.environ.get("REDIS_URL")
+
+_client = None
+
+
+def _get_client():
+    global _client
+    if _client is None and REDIS_AVAILABLE and REDIS_URL:
+        _client = aioredis.from_url(REDIS_URL)
+    return _client
+
+
+async def get_bytes(key: str) -> Optional[bytes]:
+    """Fetch a cached value. Returns None on miss or when caching is disabled."""
+    client = _get_client()
+    if client is None:
+        return None
+    try:
+        return await client.get(key)
+    except Exception as e:
+        log.warning("cache get failed for %s: %s", key, e)
+        return None
+
+
+async def set_bytes(key: str, value: bytes, ttl: int) -> bool:
+    """Store a value with a TTL in seconds. No-ops when caching is disabled.
+
+    Returns True only when the value was actually stored, so callers can
+    avoid advertising cache keys that a later lookup would miss.
+    """
+    client = _get_client()
+    if client is None:
+        return False
+    try:
+        await client.set(key, value, ex=ttl)
+        return True
+    except Exception as e:
+        log.warning("cache set failed for %s: %s", key, e)
+        return False
@@ -0,0 +1,99 @@
+"""
+Lightweight chunked retrieval over extracted PDF text.
+
+Sending the full document to Claude re-bills the same tokens on every
+question. When retrieval mode is enabled, large documents are split into
+overlapping chunks — per page first, so the [Page N] markers downstream
+highlighting relies on survive — and only the chunks that best match the
+question are spliced into the prompt.
+
+Ranking is plain lexical overlap: embedding indexes would pull in heavy
+optional dependencies (sentence-transformers, faiss/hnswlib) that this
+backend otherwise avoids, and term overlap is enough to cut 10-50x of
+context on typical re-ask workloads.
+"""
+
+import re
+from collections import Counter
+
+CHUNK_SIZE = 1200
+CHUNK_OVERLAP = 120
+TOP_K = 8
+
+_PAGE_MARKER = re.compile(r"\[Page (\d+)\]")
+_WORDS = re.compile(r"[a-z0-9]{2,}")
+
+# Terms too common to discriminate between chunks
+_STOPWORDS = frozenset(
+    "the a an and or of to in on for is are was were be with what which "
+    "who how why when where does do did this that it its as at by from".split()
+)
+
+
+def _tokens(text: str) -> list[str]:
+    return [t for t in _WORDS.findall(text.lower()) if t not in _STOPWORDS]
+
+
+def split_pages(pdf_text: str) -> list[tuple[int, str]]:
+    """Split extracted text on [Page N] markers into (page, text) pairs."""
+    pages = []
+    matches = list(_PAGE_MARKER.finditer(pdf_text))
+    if not matches:
+        return [(1, pdf_text)]
+    for i, m in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(pdf_text)
+        pages.append((int(m.group(1)), pdf_text[m.end():end].strip()))
+    return pages
+
+
+def chunk_text(pdf_text: str) -> list[tuple[int, str]]:
+    """Chunk per page, then window long pages with overlap.
+
+    Returns (page, chunk) pairs in document order; every chunk stays within a
+    single page so its page attribution is exact.
+    """
+    chunks = []
+    for page, text in split_pages(pdf_text):
+        if not text:
+            continue
+        if len(text) <= CHUNK_SIZE:
+            chunks.append((page, text))
+            continue
+        step = CHUNK_SIZE - CHUNK_OVERLAP
+        for start in range(0, len(text), step):
+            piece = text[start:start + CHUNK_SIZE]
+            if piece.strip():
+                chunks.append((page, piece))
+            if start + CHUNK_SIZE >= len(text):
+                break
+    return chunks
+
+
+def top_k_chunks(pdf_text: str, question: str, k: int = TOP_K) -> str:
+    """Return the k chunks most lexically relevant to the question.
+
+    Selected chunks are re-assembled in document order with their [Page N]
+    markers so the result drops into the prompt like a shorter document.
+    """
+    q_terms = set(_tokens(question))
+    if not q_terms:
+        return pdf_text
+
+    chunks = chunk_text(pdf_text)
+    if len(chunks) <= k:
+        return pdf_text
+
+    scored = []
+    for idx, (page, chunk) in enumerate(chunks):
+        counts = Counter(_tokens(chunk))
+        # Cap per-term frequency so one repeated word can't dominate
+        score = sum(min(counts[t], 3) for t in q_terms)
+        if score:
+            scored.append((score, idx, page, chunk))
+
+    if not scored:
+        return pdf_text
+
+    scored.sort(key=lambda s: s[0], reverse=True)
+    keep = sorted(scored[:k], key=lambda s: s[1])
+    return "\n\n".join(f"[Page {page}]\n{chunk}" for _, _, page, chunk in keep)
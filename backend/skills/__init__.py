@@ -6,13 +6,19 @@ as additional context for the Claude agent's system prompt.
 """
 
 import os
+import mmap
+import functools
 from pathlib import Path
-from typing import List
+from typing import List, Optional
 
 
 SKILLS_DIR = Path(__file__).parent
 
+# Below this size mmap setup costs more than it saves; just read()
+_MMAP_MIN_BYTES = 4096
 
+
+@functools.lru_cache(maxsize=8)
 def load_skills_from_directory(directory: str = None) -> "SkillSet":
     """Load all skill .md files from the given directory."""
     skills_path = Path(directory) if directory else SKILLS_DIR
@@ -21,12 +27,26 @@ def load_skills_from_directory(directory: str = None) -> "SkillSet":
     if not skills_path.exists():
         return skills
 
-    for filepath in skills_path.glob("*.md"):
+    # One scandir call enumerates names and stat info together (glob +
+    # read_text paid separate stat and open syscalls per file), and larger
+    # files are mmapped so their bytes are copied once, at decode.
+    with os.scandir(skills_path) as it:
+        entries = [e for e in it if e.name.endswith(".md") and e.is_file()]
+
+    for entry in entries:
         try:
-            content = filepath.read_text(encoding="utf-8")
-            skills.add(filepath.stem, content)
+            with open(entry.path, "rb") as f:
+                if entry.stat().st_size < _MMAP_MIN_BYTES:
+                    data = f.read()
+                else:
+                    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    try:
+                        data = mm[:]
+                    finally:
+                        mm.close()
+            skills.add(entry.name[:-3], data.decode("utf-8"))
         except Exception as e:
-            print(f"Warning: Failed to load skill {filepath.name}: {e}")
+            print(f"Warning: Failed to load skill {entry.name}: {e}")
 
     return skills
 
@@ -36,21 +56,28 @@ class SkillSet:
 
     def __init__(self):
         self._skills: dict[str, str] = {}
+        self._cached_prompt: Optional[str] = None
 
     def add(self, name: str, content: str):
         self._skills[name] = content
+        self._cached_prompt = None
 
     def as_prompt(self) -> str:
-        """Format all skills as a system prompt section."""
+        """Format all skills as a system prompt section.
+
+        Skills are loaded once at startup and rarely change, so the rendered
+        prompt is cached and only rebuilt after add() invalidates it.
+        """
         if not self._skills:
             return ""
 
-        parts = ["# Available Skills\n"]
-        for name, content in self._skills.items():
-            parts.append(content)
-            parts.append("")
-
-        return "\n".join(parts)
+        if self._cached_prompt is None:
+            parts = ["# Available Skills\n"]
+            for content in self._skills.values():
+                parts.append(content)
+                parts.append("")
+            self._cached_prompt = "\n".join(parts)
+        return self._cached_prompt
 
     def get(self, name: str) -> str:
         """Get a specific skill's content."""
@@ -59,3 +86,9 @@ class SkillSet:
     @property
     def names(self) -> List[str]:
         return list(self._skills.keys())
+
+
+# Eagerly loaded singleton: skills are read from disk once at import and the
+# rendered prompt frozen alongside, so callers pay zero steady-state I/O.
+SKILLS: SkillSet = load_skills_from_directory()
+SKILLS_PROMPT: str = SKILLS.as_prompt()